@@ -1,50 +1,222 @@
 import streamlit as st
 import pandas as pd
 import hashlib
+import hmac
+import openpyxl
 import os
-import time
-from sqlalchemy import text
+import uuid
+from sqlalchemy import event, text
 from datetime import datetime
+from itertools import islice
 
 # --- DATABASE SETUP ---
 conn = st.connection("my_database", type="sql")
+DB_FILE = conn.engine.url.database
+SQLITE_PRAGMAS = ("PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL",
+                  "PRAGMA temp_store=MEMORY", "PRAGMA cache_size=-65536")
+SALES_COLUMNS = [
+    "CustomerName", "CustomerType", "Product", "Quantity", "Region", "Date", "UnitPrice", "StoreLocation",
+    "Discount", "Salesperson", "TotalPrice", "PaymentMethod", "Promotion", "Returned", "OrderID",
+    "ShippingCost", "RegionManager",
+]
+KEY_COLUMNS = ["Salesperson", "RegionManager", "Region", "StoreLocation"]
+CHOICE_COLUMNS = ["CustomerType", "Product", "Region", "StoreLocation", "RegionManager"]
+# Columns the dropdowns and manager selectboxes read from the shared frame
+FRAME_COLUMNS = ["CustomerType", "Product", "Region", "StoreLocation", "Salesperson", "RegionManager"]
+DEFAULT_PW = hashlib.sha256(b"password123").hexdigest()
+ADMIN_PW = hashlib.sha256(b"admin123").hexdigest()
+
+def configure_sqlite(engine):
+    """Applies WAL and throughput pragmas to every pooled SQLite connection, once per engine."""
+    # Marked on the engine itself so a connection rebuilt after a secrets change is configured too
+    if getattr(engine, "_moneywiz_pragmas", False):
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cur.execute(pragma)
+        cur.close()
+    engine._moneywiz_pragmas = True
+    # Drop connections opened before the listener existed so they pick up the pragmas
+    engine.dispose()
+
+if conn.engine.dialect.name == "sqlite":
+    configure_sqlite(conn.engine)
+
+# --- SQL STATEMENTS ---
+INSERT_SALE = text("""INSERT INTO sales (CustomerName, CustomerType, Product, Quantity, Region, Date, UnitPrice,
+                   StoreLocation, Discount, Salesperson, TotalPrice, PaymentMethod, Promotion, Returned,
+                   OrderID, ShippingCost, RegionManager) VALUES (:n, :ct, :p, :q, :r, :d, :up, :sl, :di, :sp, :tp, :pm, :pr, :re, :oid, :sc, :rm)""")
+INSERT_USER = text("INSERT OR IGNORE INTO users (username, password, role) VALUES (:u, :p, :r)")
+UPSERT_SYNC_META = text("INSERT OR REPLACE INTO sync_meta (file, mtime, digest) VALUES (:f, :m, :d)")
 
 # --- HELPER FUNCTIONS ---
-def get_choices(df, column, defaults):
-    """Safely extracts unique values for dropdowns from the dataframe."""
-    if df is not None and not df.empty and column in df.columns:
-        choices = sorted(df[column].dropna().unique().tolist())
-        return choices if choices else defaults
-    return defaults
+def get_choices(choices, column, defaults):
+    """Safely looks up the precomputed dropdown values for a column."""
+    return choices.get(column) or defaults
+
+def normalize_keys(df):
+    """Strips and lower-cases the key columns once so later lookups are plain equality."""
+    for col in KEY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("string").str.strip().str.lower()
+    return df
+
+@st.cache_resource
+def write_counter():
+    """Process-wide count of sales writes made through this app."""
+    return {"sales": 0}
+
+def bump_data_version():
+    """Invalidates every sales cache after a write, even within the filesystem's mtime granularity."""
+    write_counter()["sales"] += 1
+
+def data_version():
+    """Cheap cache key for sales: the app's write count plus the SQLite files' latest mtime."""
+    # In WAL mode commits land in the -wal file until a checkpoint, so check both
+    paths = [DB_FILE, f"{DB_FILE}-wal"] if DB_FILE else []
+    mtime = max((os.path.getmtime(p) for p in paths if os.path.exists(p)), default=0.0)
+    return write_counter()["sales"], mtime
+
+@st.cache_data(max_entries=1, show_spinner=False)
+def load_sales(version):
+    """Loads the columns the UI needs from sales; reused across reruns until the data version changes."""
+    df = normalize_keys(conn.query(f"SELECT {', '.join(FRAME_COLUMNS)} FROM sales", ttl=0))
+    # Low-cardinality labels: integer codes keep the cached frame small and make unique() cheap
+    return df.astype("category")
+
+@st.cache_data(max_entries=1, show_spinner=False)
+def load_choices(version):
+    """Builds the sorted dropdown values for every choice column once per data version."""
+    df = load_sales(version)
+    return {col: sorted(df[col].dropna().unique().tolist()) for col in CHOICE_COLUMNS if col in df.columns}
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_my_sales(user, version):
+    """Loads only one salesperson's rows, filtered in SQL rather than in pandas."""
+    df = normalize_keys(conn.query("SELECT * FROM sales WHERE lower(Salesperson) = :u", params={"u": user}, ttl=0))
+    # Typed once here so record lookups can compare directly without astype(str) per keystroke
+    return df.astype({"OrderID": "string", "CustomerName": "string"})
+
+@st.cache_data(max_entries=3, show_spinner=False)
+def product_sales_by(column, version):
+    """Sums TotalPrice per (column value, Product) in SQL once per data version."""
+    if column not in ("Region", "StoreLocation", "Salesperson"):
+        raise ValueError(f"Unsupported filter column: {column}")
+    # Grouped on the same strip/lower form normalize_keys gives the selectbox options
+    res = conn.query(f"SELECT lower(trim({column})) AS {column}, Product, SUM(TotalPrice) AS TotalPrice "
+                     f"FROM sales GROUP BY 1, Product", ttl=0)
+    return res.set_index([column, "Product"])["TotalPrice"]
+
+@st.cache_data(max_entries=1, show_spinner=False)
+def top_product_per_store(version):
+    """Returns the best-selling product's TotalPrice for each store, once per data version."""
+    res = conn.query("""
+        SELECT StoreLocation, TotalPrice FROM (
+            SELECT lower(trim(StoreLocation)) AS StoreLocation, SUM(TotalPrice) AS TotalPrice,
+                   ROW_NUMBER() OVER (PARTITION BY lower(trim(StoreLocation)) ORDER BY SUM(TotalPrice) DESC, Product) AS rn
+            FROM sales GROUP BY 1, Product
+        ) WHERE rn = 1
+    """, ttl=0)
+    return res.set_index("StoreLocation")["TotalPrice"]
+
+@st.cache_data(max_entries=1, show_spinner=False)
+def returns_by_store(version):
+    """Counts returned orders per (StoreLocation, Product) in SQL once per data version."""
+    # Returned holds 1/0 from the workbook import and Yes/No from the Add form
+    res = conn.query("""
+        SELECT lower(trim(StoreLocation)) AS StoreLocation, Product,
+               SUM(CASE WHEN lower(trim(Returned)) IN ('1', 'yes', 'true') THEN 1 ELSE 0 END) AS Returned
+        FROM sales GROUP BY 1, Product
+    """, ttl=0)
+    return res.set_index(["StoreLocation", "Product"])["Returned"]
+
+@st.cache_data(max_entries=1, show_spinner=False)
+def salesperson_totals(version):
+    """Sums TotalPrice per Salesperson in SQL once per data version."""
+    res = conn.query("SELECT lower(trim(Salesperson)) AS Salesperson, SUM(TotalPrice) AS TotalPrice FROM sales GROUP BY 1",
+                     ttl=0)
+    return res.set_index("Salesperson")["TotalPrice"]
+
+def product_sales(column, value):
+    """Looks up the per-Product totals for one Region/Store/Salesperson from the cached aggregate."""
+    # A value SQLite lower() folds differently (or a missing one) charts as empty rather than raising
+    return product_sales_by(column, data_version()).get(value, pd.Series(dtype="float64"))
+
+@st.cache_data(ttl=300, max_entries=256, show_spinner=False)
+def lookup_user(username, version):
+    """Fetches a user's stored password hash and role, briefly memoised so repeat logins skip the query."""
+    return conn.query("SELECT password, role FROM users WHERE username=:u",
+                      params={"u": username}, ttl=0).to_dict("records")
+
+def read_sales_workbook(path, batch_size=5000):
+    """Streams the workbook in read-only mode, yielding batches of the columns the sales table stores."""
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = [str(c).strip() if c is not None else "" for c in next(rows, ())]
+        keep = [i for i, c in enumerate(header) if c in SALES_COLUMNS]
+        columns = [header[i] for i in keep]
+        while batch := list(islice(rows, batch_size)):
+            yield pd.DataFrame([[r[i] for i in keep] for r in batch], columns=columns).dropna(how="all")
+    finally:
+        wb.close()
+
+def file_digest(path):
+    """Returns the SHA-256 of a file's bytes, read in blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def insert_or_ignore(table, db, keys, data_iter):
+    """to_sql insert method that skips rows whose OrderID is already stored."""
+    sql = text(f"INSERT OR IGNORE INTO {table.name} ({', '.join(keys)}) VALUES ({', '.join(':' + k for k in keys)})")
+    return db.execute(sql, [dict(zip(keys, row)) for row in data_iter]).rowcount
+
+def ingest_workbook(path):
+    """Appends the workbook's sales and provisions its salespeople and managers as users."""
+    role_columns = [("Salesperson", "Salesperson"), ("RegionManager", "Region Manager")]
+    seen = {col: {} for col, _ in role_columns}
+    for df in read_sales_workbook(path):
+        normalize_keys(df)
+        # Append to preserve manually added data; rows already synced are skipped by OrderID
+        df.to_sql("sales", conn.engine, if_exists="append", index=False, method=insert_or_ignore)
+        for col, _ in role_columns:
+            if col in df.columns:
+                seen[col].update(dict.fromkeys(df[col].dropna().astype(str)))
+
+    users = [{"u": user, "p": DEFAULT_PW, "r": role} for col, role in role_columns for user in seen[col]]
+    if users:
+        with conn.session as s, s.begin():
+            # A list of params makes SQLAlchemy run a single executemany
+            s.execute(INSERT_USER, users)
 
 def sync_data_from_excel():
-    """Reads, normalizes, and migrates Excel data to SQL automatically."""
+    """Reads, normalizes, and migrates Excel data to SQL, skipping files that have not changed."""
     if os.path.exists("customers.xlsx"):
         try:
-            df = pd.read_excel("customers.xlsx")
-            df.columns = df.columns.str.strip()
-            cols_to_normalize = ["Salesperson", "RegionManager", "Region", "StoreLocation"]
-            for col in cols_to_normalize:
-                if col in df.columns:
-                    df[col] = df[col].astype(str).str.strip().str.lower()
-            
-            # Use append to preserve manually added data
-            df.to_sql("sales", conn.engine, if_exists="append", index=False)
-            
-            default_pw = hashlib.sha256("password123".encode()).hexdigest()
-            with conn.session as s:
-                for col, role in [("Salesperson", "Salesperson"), ("RegionManager", "Region Manager")]:
-                    if col in df.columns:
-                        for user in df[col].dropna().unique():
-                            s.execute(text("INSERT OR IGNORE INTO users VALUES (:u, :p, :r)"), 
-                                      {"u": str(user), "p": default_pw, "r": role})
-                s.commit()
+            mtime = os.path.getmtime("customers.xlsx")
+            meta = conn.query("SELECT mtime, digest FROM sync_meta WHERE file = :f",
+                              params={"f": "customers.xlsx"}, ttl=0)
+            if not meta.empty and meta.iloc[0]["mtime"] == mtime:
+                return
+            digest = file_digest("customers.xlsx")
+            if meta.empty or meta.iloc[0]["digest"] != digest:
+                ingest_workbook("customers.xlsx")
+                bump_data_version()
+            with conn.session as s, s.begin():
+                s.execute(UPSERT_SYNC_META, {"f": "customers.xlsx", "m": mtime, "d": digest})
         except Exception as e:
             st.error(f"Automatic Sync Error: {e}")
 
-def init_db():
-    """Initializes standard SQL tables with full schema."""
-    with conn.session as s:
+@st.cache_resource
+def init_db(db_url):
+    """Initializes standard SQL tables with full schema, once per database rather than per rerun."""
+    with conn.session as s, s.begin():
         s.execute(text("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT, role TEXT);"))
         s.execute(text("""
             CREATE TABLE IF NOT EXISTS sales (
@@ -56,10 +228,33 @@ def init_db():
                 RegionManager TEXT
             );
         """))
+        s.execute(text("CREATE TABLE IF NOT EXISTS sync_meta (file TEXT PRIMARY KEY, mtime REAL, digest TEXT);"))
+        # Cover the filter + GROUP BY Product workload of the analytics views
+        for ddl in [
+            "CREATE INDEX IF NOT EXISTS idx_sales_region ON sales(Region, Product, TotalPrice);",
+            "CREATE INDEX IF NOT EXISTS idx_sales_store ON sales(StoreLocation, Product, TotalPrice);",
+            "CREATE INDEX IF NOT EXISTS idx_sales_sp ON sales(Salesperson, Product, TotalPrice);",
+            "CREATE INDEX IF NOT EXISTS idx_sales_sp_lc ON sales(lower(Salesperson));",
+            "CREATE INDEX IF NOT EXISTS idx_sales_cust ON sales(CustomerName COLLATE NOCASE);",
+        ]:
+            s.execute(text(ddl))
+        # OrderID is unique so re-syncing a workbook is idempotent. Older Add-form IDs were per-second
+        # timestamps, so distinct customers can share one; keep every row and suffix the later IDs with their id
+        if not s.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_sales_orderid'")).first():
+            s.execute(text("""
+                UPDATE sales SET OrderID = OrderID || '-' || id WHERE OrderID IS NOT NULL
+                AND id NOT IN (SELECT MIN(id) FROM sales WHERE OrderID IS NOT NULL GROUP BY OrderID)
+            """))
+            s.execute(text("DROP INDEX IF EXISTS idx_sales_oid;"))
+            s.execute(text("CREATE UNIQUE INDEX idx_sales_orderid ON sales(OrderID);"))
         # Ensure Admin is Provisioned
-        admin_pw = hashlib.sha256("admin123".encode()).hexdigest()
-        s.execute(text("INSERT OR IGNORE INTO users VALUES ('admin', :p, 'Region Manager')"), {"p": admin_pw})
-        s.commit()
+        s.execute(INSERT_USER, {"u": "admin", "p": ADMIN_PW, "r": "Region Manager"})
+
+def ensure_db():
+    """Runs init_db for the current engine's database, and again if its SQLite file has been removed."""
+    if DB_FILE and DB_FILE != ":memory:" and not os.path.exists(DB_FILE):
+        init_db.clear()
+    init_db(str(conn.engine.url))
 
 # --- AUTHENTICATION ---
 def login():
@@ -69,13 +264,12 @@ def login():
     
     if st.sidebar.button("Login"):
         hpw = hashlib.sha256(p_input.encode()).hexdigest()
-        res = conn.query("SELECT role FROM users WHERE username=:u AND password=:p", 
-                         params={"u": u_input, "p": hpw}, ttl=0)
-        
-        if not res.empty:
+        rows = lookup_user(u_input, data_version())
+
+        if rows and hmac.compare_digest(str(rows[0]['password']), hpw):
             st.session_state.logged_in = True
             st.session_state.username = u_input
-            st.session_state.role = res.iloc[0]['role']
+            st.session_state.role = rows[0]['role']
             # Always sync on login to ensure data is available
             if "synced" not in st.session_state:
                 sync_data_from_excel()
@@ -86,7 +280,7 @@ def login():
 
 # --- MAIN APP ---
 def main():
-    init_db() # Create tables first
+    ensure_db() # Create tables first
     
     if "logged_in" not in st.session_state: 
         st.session_state.logged_in = False
@@ -97,7 +291,10 @@ def main():
         return
 
     # Fetch data for the session
-    df_all = conn.query("SELECT * FROM sales", ttl=0)
+    df_all = load_sales(data_version())
+
+    if "last_notice" in st.session_state:
+        st.toast(st.session_state.pop("last_notice"), icon="🎉")
 
     st.sidebar.write(f"Logged in: **{st.session_state.username}**")
     if st.sidebar.button("Logout"):
@@ -110,7 +307,8 @@ def main():
     # --- SALESPERSON WORKSPACE ---
     if role == "Salesperson":
         st.header("👤 Salesperson Workspace")
-        my_data = df_all[df_all["Salesperson"].astype(str).str.lower() == user]
+        my_data = load_my_sales(user, data_version())
+        choices = load_choices(data_version())
         
         tabs = st.tabs(["Add Customer", "Update Record", "Delete Customer", "View All", "Search Customer", "Analytics"])
         
@@ -119,40 +317,36 @@ def main():
             with st.form("add_form", clear_on_submit=True):
                 c1, c2, c3 = st.columns(3)
                 name = c1.text_input("Customer Name")
-                c_type = c1.selectbox("Customer Type", get_choices(df_all, "CustomerType", ["Retail", "Wholesale"]))
-                prod = c1.selectbox("Product", get_choices(df_all, "Product", ["Laptop", "Phone", "Tablet"]))
+                c_type = c1.selectbox("Customer Type", get_choices(choices, "CustomerType", ["Retail", "Wholesale"]))
+                prod = c1.selectbox("Product", get_choices(choices, "Product", ["Laptop", "Phone", "Tablet"]))
                 qty = c1.number_input("Quantity", min_value=1, value=1)
                 u_p = c2.number_input("Unit Price", min_value=0.0, value=0.0)
                 disc = c2.number_input("Discount", min_value=0.0, value=0.0)
-                reg = c2.selectbox("Region", get_choices(df_all, "Region", ["North", "South"]))
-                loc = c2.selectbox("Store Location", get_choices(df_all, "StoreLocation", ["Main Store"]))
+                reg = c2.selectbox("Region", get_choices(choices, "Region", ["North", "South"]))
+                loc = c2.selectbox("Store Location", get_choices(choices, "StoreLocation", ["Main Store"]))
                 
                 # Formula Logic
                 ship = c3.number_input("Shipping Cost", min_value=0.0, value=0.0)
                 calc_total = (qty * u_p) - disc + ship
                 c2.number_input("Total Price (Calculated)", value=calc_total, disabled=True)
-                
-                sys_oid = f"ORD-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                c3.info(f"Generated OrderID: {sys_oid}")
+
                 pay = c3.selectbox("Payment Method", ["Cash", "Card", "Online"])
                 prom = c3.text_input("Promotion")
                 ret_status = c3.text_input("Returned (Status)", value="No") 
-                r_man = c3.selectbox("Region Manager", get_choices(df_all, "RegionManager", ["Admin"]))
+                r_man = c3.selectbox("Region Manager", get_choices(choices, "RegionManager", ["Admin"]))
                 
                 if st.form_submit_button("Submit"):
-                    with conn.session as s:
-                        s.execute(text("""INSERT INTO sales (CustomerName, CustomerType, Product, Quantity, Region, Date, UnitPrice, 
-                                       StoreLocation, Discount, Salesperson, TotalPrice, PaymentMethod, Promotion, Returned, 
-                                       OrderID, ShippingCost, RegionManager) VALUES (:n, :ct, :p, :q, :r, :d, :up, :sl, :di, :sp, :tp, :pm, :pr, :re, :oid, :sc, :rm)"""),
+                    # Generated only on submit; random so concurrent adds cannot collide
+                    sys_oid = f"ORD-{uuid.uuid4().hex[:12].upper()}"
+                    with conn.session as s, s.begin():
+                        s.execute(INSERT_SALE,
                                   {"n":name, "ct":c_type, "p":prod, "q":qty, "r":reg.lower(), "d":datetime.now().strftime("%Y-%m-%d"), 
                                    "up":u_p, "sl":loc.lower(), "di":disc, "sp":user, "tp":calc_total, "pm":pay, "pr":prom, "re":ret_status, 
                                    "oid":sys_oid, "sc":ship, "rm":r_man.lower()})
-                        s.commit()
+                    bump_data_version()
                     
-                    msg = st.empty()
-                    msg.success(f"🎉 Customer added! OrderID: {sys_oid}")
-                    time.sleep(5)
-                    msg.empty()
+                    # Shown as a toast on the next run instead of blocking this one
+                    st.session_state.last_notice = f"Customer added! OrderID: {sys_oid}"
                     st.rerun()
         
         # ... (Other salesperson tabs: Update, Delete, View, Search, Analytics)
@@ -176,27 +370,25 @@ def main():
 
             if m_opt == "Region-wise Sale":
                 r_choice = st.selectbox("Select Region", df_all["Region"].unique())
-                st.bar_chart(df_all[df_all["Region"] == r_choice].groupby("Product")["TotalPrice"].sum())
+                st.bar_chart(product_sales("Region", r_choice))
 
             elif m_opt == "Store-wise Sale":
                 s_choice = st.selectbox("Select Store", df_all["StoreLocation"].unique())
-                st.bar_chart(df_all[df_all["StoreLocation"] == s_choice].groupby("Product")["TotalPrice"].sum())
+                st.bar_chart(product_sales("StoreLocation", s_choice))
 
             elif m_opt == "Person-wise Sale":
                 p_choice = st.selectbox("Select Salesperson", df_all["Salesperson"].unique())
-                st.bar_chart(df_all[df_all["Salesperson"] == p_choice].groupby("Product")["TotalPrice"].sum())
+                st.bar_chart(product_sales("Salesperson", p_choice))
 
             elif m_opt == "Max Product per Store":
-                grouped = df_all.groupby(["StoreLocation", "Product"])["TotalPrice"].sum().reset_index()
-                idx = grouped.groupby("StoreLocation")["TotalPrice"].idxmax()
-                st.bar_chart(grouped.loc[idx].set_index("StoreLocation")["TotalPrice"])
+                st.bar_chart(top_product_per_store(data_version()))
 
             elif m_opt == "Salesperson Max Sales":
-                st.bar_chart(df_all.groupby("Salesperson")["TotalPrice"].sum())
+                st.bar_chart(salesperson_totals(data_version()))
 
             elif m_opt == "Store-wise Return":
                 sr_choice = st.selectbox("Select Store for Returns", df_all["StoreLocation"].unique())
-                st.bar_chart(df_all[df_all["StoreLocation"] == sr_choice].groupby("Product")["Returned"].count())
+                st.bar_chart(returns_by_store(data_version()).get(sr_choice, pd.Series(dtype="int64")))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file